@@ -1,64 +1,67 @@
 # fruitell_program_from_csv.py (robust, fixed)
-import argparse, time, csv, serial, os, sys
+import argparse, time, csv, io, mmap, re, serial, os, sys
+import numpy as np
+
+_NUM_RE = re.compile(r"^-?\d+(?:\.\d*)?(?:[eE][+-]?\d+)?$")
+
+def isnum(s):
+    return bool(_NUM_RE.match(s.strip()))
 
 def read_rows(csv_path):
-    out = []
-    with open(csv_path, "r", newline="") as f:
-        r = csv.reader(f)
-        first = next(r, None)
-        if first is None:
-            return out
-
-        def isnum(s):
-            try:
-                float(s); return True
-            except:
-                return False
-
-        header = any(not isnum(c.strip()) for c in first)
-
-        if header:
-            hdr = [c.strip().lower().replace(" ", "_") for c in first]
-            alias = {
-                "echo_us": {"echo_us","echo","med_us","median_us"},
-                "label": {"label","class","y"},
-                "fresh_anchor": {"fresh_anchor","fresh","fresh_us","f_anchor"},
-                "spoil_anchor": {"spoil_anchor","spoil","spoil_us","s_anchor"},
-            }
-            idx = {}
-            for i, n in enumerate(hdr):
-                for k, al in alias.items():
-                    if n in al and k not in idx:
-                        idx[k] = i
-            if not all(k in idx for k in ("echo_us","label","fresh_anchor","spoil_anchor")):
-                print("Bad header:", first, file=sys.stderr)
-                return out
-
-            for row in r:
-                if len(row) < 4: continue
-                try:
-                    out.append((
-                        int(float(row[idx["echo_us"]])),
-                        int(float(row[idx["label"]])),
-                        int(float(row[idx["fresh_anchor"]])),
-                        int(float(row[idx["spoil_anchor"]])),
-                    ))
-                except:
-                    pass
-        else:
-            raw_rows = [first] + list(r)   # <- use a separate list
-            for row in raw_rows:
-                if len(row) < 4: continue
-                try:
-                    out.append((
-                        int(float(row[0])),
-                        int(float(row[1])),
-                        int(float(row[2])),
-                        int(float(row[3])),
-                    ))
-                except:
-                    pass
-    return out
+    empty = np.empty((0, 4), dtype=np.int64)
+    # mmap so the OS page cache serves the whole file; one open, no
+    # second pass through the filesystem for the genfromtxt read below
+    with open(csv_path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # zero-length file
+            return empty
+        with mm:
+            # skip leading blank lines so header sniffing sees real content
+            while True:
+                start = mm.tell()
+                raw = mm.readline()
+                if not raw:
+                    return empty
+                if raw.strip():
+                    break
+            first = next(csv.reader([raw.decode("ascii", "ignore")]), None)
+            if not first:
+                return empty
+            return _parse_rows(mm, first, start, empty)
+
+def _parse_rows(mm, first, start, empty):
+    header = any(not isnum(c) for c in first)
+
+    if header:
+        hdr = [c.strip().lower().replace(" ", "_") for c in first]
+        alias = {
+            "echo_us": {"echo_us","echo","med_us","median_us"},
+            "label": {"label","class","y"},
+            "fresh_anchor": {"fresh_anchor","fresh","fresh_us","f_anchor"},
+            "spoil_anchor": {"spoil_anchor","spoil","spoil_us","s_anchor"},
+        }
+        idx = {}
+        for i, n in enumerate(hdr):
+            for k, al in alias.items():
+                if n in al and k not in idx:
+                    idx[k] = i
+        if not all(k in idx for k in ("echo_us","label","fresh_anchor","spoil_anchor")):
+            print("Bad header:", first, file=sys.stderr)
+            return empty
+        usecols = tuple(idx[k] for k in ("echo_us","label","fresh_anchor","spoil_anchor"))
+    else:
+        usecols = (0, 1, 2, 3)
+
+    # one C-level pass over the mapped pages (from the first non-blank line);
+    # bad cells become NaN and get dropped
+    arr = np.genfromtxt(io.BytesIO(mm[start:]), delimiter=",", usecols=usecols,
+                        skip_header=1 if header else 0, invalid_raise=False)
+    if arr.size == 0:
+        return empty
+    arr = arr.reshape(-1, 4)  # single-row files come back 1-D
+    arr = arr[~np.isnan(arr).any(axis=1)]
+    return arr.astype(np.int64)
 
 def main():
     ap = argparse.ArgumentParser()
@@ -74,7 +77,7 @@ def main():
 
     rows = read_rows(args.csv)
     print("Parsed rows:", len(rows))
-    if rows[:3]: print("First rows:", rows[:min(3, len(rows))])
+    if len(rows): print("First rows:", rows[:3].tolist())
 
     ser = serial.Serial(args.port, args.baud, timeout=0.4, write_timeout=2)
     try:
@@ -84,40 +87,46 @@ def main():
         # BEGIN
         ser.write(b"CSVTEST:BEGIN\r\n"); ser.flush()
 
-        # wait for READY (optional but nice)
-        t0 = time.time()
-        while time.time() - t0 < 3.0:
-            ln = ser.readline().decode(errors="ignore").strip()
+        # wait for READY (optional but nice) — one C-level scan, 3s timeout
+        old_timeout = ser.timeout
+        ser.timeout = 3.0
+        blob = ser.read_until(b"CSVTEST:READY", size=4096)
+        ser.timeout = old_timeout
+        for ln in blob.splitlines():
+            ln = ln.strip()
             if ln:
-                print("[device]", ln)
-                if "CSVTEST:READY" in ln:
-                    break
+                print("[device]", ln.decode(errors="ignore"))
+
+        # format every row up front; the timed loop only joins and writes
+        payload_lines = [f"{echo},{lab},{fa},{sa}\r\n".encode()
+                         for (echo, lab, fa, sa) in rows.tolist()]
 
-        # send rows, slow & CRLF
+        # send rows paced per line — the firmware drains one line per ~5ms
+        # tick into a 64-byte RX buffer, so bursts overrun it; no per-row
+        # flush though, the kernel TX buffer drains while we sleep
         sent = 0
-        for (echo, lab, fa, sa) in rows:
-            line = f"{echo},{lab},{fa},{sa}\r\n".encode()
-            ser.write(line); ser.flush()
+        for line in payload_lines:
+            ser.write(line)
             sent += 1
             time.sleep(args.per_line_delay)
 
-        # END
+        # END (flush so every queued row is on the wire before the marker counts)
         ser.write(b"CSVTEST:END\r\n"); ser.flush()
 
         # read device report
         t0 = time.time(); any_out = False
         while time.time() - t0 < args.wait:
-            line = ser.readline().decode(errors="ignore").strip()
+            line = ser.readline().strip()
             if line:
                 any_out = True
-                print("[device]", line)
+                print("[device]", line.decode("ascii", "ignore"))
 
         # final status
         ser.write(b"R\r\n"); ser.flush(); time.sleep(0.2)
         t0 = time.time()
         while time.time() - t0 < 2.0:
-            line = ser.readline().decode(errors="ignore").strip()
-            if line: print("[device]", line)
+            line = ser.readline().strip()
+            if line: print("[device]", line.decode("ascii", "ignore"))
 
         print(f"Sent rows: {sent}")
         if sent == 0:
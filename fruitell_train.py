@@ -7,7 +7,7 @@
 #
 # pip install pyserial numpy scikit-learn
 
-import argparse, os, sys, time, csv, threading, queue, re
+import argparse, os, sys, time, math, threading, queue, re, collections, functools
 from dataclasses import dataclass
 import numpy as np
 import serial, serial.tools.list_ports
@@ -19,13 +19,32 @@ try:
 except Exception:
     HAVE_SK = False
 
+# Optional numba to JIT the gradient-descent fallback
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except Exception:
+    HAVE_NUMBA = False
+
+# Optional scipy for an overflow-safe C sigmoid
+try:
+    from scipy.special import expit
+except Exception:
+    def expit(z, out=None):
+        # stable fallback: expit(z) = 0.5*(1+tanh(z/2)), computed in place
+        out = np.multiply(z, 0.5, out=out)
+        np.tanh(out, out=out)
+        out += 1.0
+        out *= 0.5
+        return out
+
 IS_WINDOWS = (os.name == "nt")
 if IS_WINDOWS:
     import msvcrt  # non-blocking single key
 
 # ---------------- Models & parsing ----------------
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Sample:
     echo_us: float
     label: int   # 1=fresh, 0=spoil
@@ -34,47 +53,53 @@ class Sample:
 
 CSV_FIELDS = ["ts_ms","echo_us","mad_us","fresh_pct","conf_pct","fresh_anchor","spoil_anchor"]
 
+Rec = collections.namedtuple("Rec", CSV_FIELDS)  # one per serial line; cheaper than a dict
+
+# groups (positional): fresh, conf, echo, mad, F, S
 HUMAN_RE = re.compile(
-    r"Fresh\s*=\s*(?P<fresh>[\d.]+)\%.*?"
-    r"Conf\s*=\s*(?P<conf>[\d.]+)\%.*?"
-    r"Echo\s*=\s*(?P<echo>[\d.]+)\s*us.*?"
-    r"MAD\s*=\s*(?P<mad>[\d.]+)\s*us.*?"
-    r"F\s*=\s*(?P<F>\d+).*?"
-    r"S\s*=\s*(?P<S>\d+)",
+    r"Fresh\s*=\s*([\d.]+)\%.*?"
+    r"Conf\s*=\s*([\d.]+)\%.*?"
+    r"Echo\s*=\s*([\d.]+)\s*us.*?"
+    r"MAD\s*=\s*([\d.]+)\s*us.*?"
+    r"F\s*=\s*(\d+).*?"
+    r"S\s*=\s*(\d+)",
     re.IGNORECASE
 )
+HUMAN_SEARCH = HUMAN_RE.search  # pre-bound for the per-line hot path
 
 def parse_device_csv_line(line: str):
     """Parse Arduino CSV: ts,echo,mad,fresh,conf,F,S"""
+    parts = line.split(",", 6)
+    if len(parts) != 7:
+        return None
     try:
-        parts = [p.strip() for p in line.split(",")]
-        if len(parts) < 7:
-            return None
-        return {
-            "ts_ms": int(float(parts[0])),
-            "echo_us": float(parts[1]),
-            "mad_us": float(parts[2]),
-            "fresh_pct": float(parts[3]),
-            "conf_pct": float(parts[4]),
-            "fresh_anchor": float(parts[5]),
-            "spoil_anchor": float(parts[6]),
-        }
+        # firmware emits no spaces; only a trailing \r can survive readline
+        return Rec(
+            int(float(parts[0])),
+            float(parts[1]),
+            float(parts[2]),
+            float(parts[3]),
+            float(parts[4]),
+            float(parts[5]),
+            float(parts[6].rstrip()),
+        )
     except:
         return None
 
 def parse_human_line(line: str):
-    m = HUMAN_RE.search(line)
+    m = HUMAN_SEARCH(line)
     if not m: return None
     try:
-        return {
-            "ts_ms": int(time.time()*1000),
-            "echo_us": float(m.group("echo")),
-            "mad_us": float(m.group("mad")),
-            "fresh_pct": float(m.group("fresh")),
-            "conf_pct": float(m.group("conf")),
-            "fresh_anchor": float(m.group("F")),
-            "spoil_anchor": float(m.group("S")),
-        }
+        fresh, conf, echo, mad, F, S = m.groups()
+        return Rec(
+            int(time.time()*1000),
+            float(echo),
+            float(mad),
+            float(fresh),
+            float(conf),
+            float(F),
+            float(S),
+        )
     except:
         return None
 
@@ -88,20 +113,39 @@ def scale_echo(echo_us: float, fa: float, sa: float) -> float:
         x = 1.0 - x
     return x
 
+if HAVE_NUMBA:
+    @njit(cache=True, fastmath=True)
+    def _gd_jit(x, y, iters=4000):
+        w=0.0; b=0.0; lr=0.5; n=x.shape[0]
+        for _ in range(iters):
+            dw=0.0; db=0.0
+            for i in range(n):
+                yhat = 1.0/(1.0+math.exp(-(b+w*x[i])))
+                d = yhat - y[i]; db += d; dw += d*x[i]
+            w -= lr*dw/n; b -= lr*db/n; lr *= 0.9995
+        return w, b
+
 def fit_logistic_1d(X, y):
     X = np.asarray(X).reshape(-1,1)
     y = np.asarray(y).astype(np.float64)
     if HAVE_SK:
-        clf = LogisticRegression(solver="lbfgs", penalty="l2", C=1e3, max_iter=1000)
+        # 1 feature: liblinear's coordinate descent converges in a few steps
+        clf = LogisticRegression(solver="liblinear", penalty="l2", C=1e3, max_iter=200)
         clf.fit(X, y)
         return float(clf.coef_[0][0]), float(clf.intercept_[0])
-    # fallback GD
+    if HAVE_NUMBA:
+        w, b = _gd_jit(np.ascontiguousarray(X[:,0]), y)
+        return float(w), float(b)
+    # fallback GD (vectorized, reuses buffers instead of 3-4 temporaries/step)
+    x = X[:,0].copy()
+    z = np.empty_like(x); yhat = np.empty_like(x); diff = np.empty_like(x)
     w=0.0; b=0.0; lr=0.5
     for _ in range(4000):
-        z = b + w*X[:,0]
-        yhat = 1.0/(1.0+np.exp(-z))
-        db = np.mean(yhat - y)
-        dw = np.mean((yhat - y) * X[:,0])
+        np.multiply(x, w, out=z); z += b
+        expit(z, out=yhat)
+        np.subtract(yhat, y, out=diff)
+        db = diff.mean()
+        dw = np.dot(diff, x) / x.size
         w -= lr*dw; b -= lr*db; lr *= 0.9995
     return float(w), float(b)
 
@@ -113,11 +157,17 @@ def emit_W_line(w_fmed, b):
 
 # ---------------- I/O helpers ----------------
 
+PREFERRED_VIDS = frozenset({"1A86", "2341", "2A03", "10C4"})  # CH340, Arduino, CP210x
+
+@functools.lru_cache(maxsize=1)
+def _list_ports():
+    # comports() is a slow WMI call on Windows; scan once per process
+    return tuple(serial.tools.list_ports.comports())
+
 def autodetect_port():
-    preferred_vids = {"1A86", "2341", "2A03", "10C4"}  # CH340, Arduino, CP210x
-    for p in serial.tools.list_ports.comports():
+    for p in _list_ports():
         vid = f"{p.vid:04X}" if p.vid is not None else ""
-        if vid in preferred_vids: return p.device
+        if vid in PREFERRED_VIDS: return p.device
         if "CH340" in (p.description or "") or "Arduino" in (p.description or ""):
             return p.device
     return None
@@ -133,50 +183,60 @@ def open_port_with_retries(port, baud, tries=6, delay=1.0):
             return ser
         except serial.SerialException as e:
             last_err = e
+            _list_ports.cache_clear()  # port set may have changed; rescan next time
             print(f"[open retry {i}/{tries}] {e}")
             time.sleep(delay)
     raise last_err or RuntimeError("Failed to open port")
 
 def save_csv(path, rows):
     os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # rows contain no commas/quotes, so skip csv.writer and emit one blob
+    lines = [f"{r.echo_us:.3f},{r.label},{r.fresh_anchor:.3f},{r.spoil_anchor:.3f}" for r in rows]
     with open(path, "w", newline="") as f:
-        w = csv.writer(f)
-        w.writerow(["echo_us","label","fresh_anchor","spoil_anchor"])
-        for r in rows:
-            w.writerow([f"{r.echo_us:.3f}", r.label, f"{r.fresh_anchor:.3f}", f"{r.spoil_anchor:.3f}"])
+        f.write("echo_us,label,fresh_anchor,spoil_anchor\n")
+        if lines:
+            f.write("\n".join(lines)); f.write("\n")
     print(f"[saved] {path}")
 
+class SessionColumns:
+    """Column (SoA) view of a session CSV — one float64 array per field."""
+    __slots__ = ("echo_us", "label", "fresh_anchor", "spoil_anchor")
+
+    def __init__(self, arr):
+        self.echo_us = arr[:,0]
+        self.label = arr[:,1].astype(np.int8)
+        self.fresh_anchor = arr[:,2]
+        self.spoil_anchor = arr[:,3]
+
+    def __len__(self):
+        return self.echo_us.size
+
 def load_csv(path):
-    rows=[]
-    with open(path, "r", newline="") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            rows.append(Sample(
-                echo_us=float(row["echo_us"]),
-                label=int(row["label"]),
-                fresh_anchor=float(row.get("fresh_anchor", "1400")),
-                spoil_anchor=float(row.get("spoil_anchor", "2600")),
-            ))
-    return rows
+    arr = np.loadtxt(path, delimiter=",", skiprows=1, dtype=np.float64, ndmin=2)
+    if arr.size == 0:
+        arr = arr.reshape(0, 4)
+    if arr.shape[1] < 4:  # anchors not logged -> firmware defaults
+        defaults = np.array([0.0, 0.0, 1400.0, 2600.0])
+        arr = np.hstack([arr, np.broadcast_to(defaults[arr.shape[1]:], (len(arr), 4-arr.shape[1]))])
+    return SessionColumns(arr)
 
 # ---------------- Key reader thread ----------------
 
-def start_key_reader():
+def start_key_reader(event=None):
     """
     Returns a Queue that receives single-char keys: 'f','s','q'
     Works on Windows (instant, no Enter). On others, it reads lines and uses the first char.
+    If an Event is given, it is set after each key so waiters wake immediately.
     """
     q = queue.Queue()
 
     def run():
         if IS_WINDOWS:
             while True:
-                if msvcrt.kbhit():
-                    ch = msvcrt.getwch()
-                    if ch:
-                        q.put(ch.lower())
-                else:
-                    time.sleep(0.01)
+                ch = msvcrt.getwch()  # blocks in the kernel until a key arrives
+                if ch:
+                    q.put(ch.lower())
+                    if event: event.set()
         else:
             # fallback: read a line; take first non-space char
             while True:
@@ -186,6 +246,7 @@ def start_key_reader():
                 ch = next((c for c in line.strip().lower() if c), "")
                 if ch:
                     q.put(ch)
+                    if event: event.set()
 
     t = threading.Thread(target=run, daemon=True)
     t.start()
@@ -206,9 +267,9 @@ def ping_only(args):
     ser.write(b"R\n")
     t_end = time.time()+1.5; got=False
     while time.time()<t_end:
-        line = ser.readline().decode(errors="ignore").strip()
-        if line:
-            got=True; print("[device]", line)
+        raw = ser.readline().strip()
+        if raw:
+            got=True; print("[device]", raw.decode("ascii", "ignore"))
     ser.close()
     print("[ping]", "OK" if got else "No response (check baud or firmware)")
 
@@ -226,31 +287,37 @@ def capture_mode(args):
     print("[capture] Serial buffers cleared")
 
     qrecs = queue.Queue()
-    keyq  = start_key_reader()
+    data_event = threading.Event()  # set by reader/key threads; main just waits
+    keyq  = start_key_reader(data_event)
 
     def reader():
         try:
             got_any = False
-            last_tx = 0.0
             # Send TRAIN:ON once at start
             ser.write(b"TRAIN:ON\n")
             last_tx = time.time()
+            buf = bytearray()
             while True:
-                raw = ser.readline().decode(errors="ignore").strip()
-
+                # block for one byte, then drain whatever arrived in one read
+                chunk = ser.read(ser.in_waiting or 1)
+                if chunk:
+                    buf += chunk
+                    while b"\n" in buf:
+                        line, _, buf = buf.partition(b"\n")
+                        line = line.strip()
+                        if not line:
+                            continue
+                        got_any = True
+                        # firmware output is pure ASCII; decode only real payloads
+                        raw = line.decode("ascii", "ignore")
+                        rec = parse_device_csv_line(raw) or parse_human_line(raw)
+                        if rec:
+                            qrecs.put(rec)
+                            data_event.set()
                 # If nothing yet, keep nudging every 1.5s (board may have missed it)
-                if not raw and not got_any and (time.time() - last_tx) > 1.5:
+                elif not got_any and (time.time() - last_tx) > 1.5:
                     ser.write(b"TRAIN:ON\n")
                     last_tx = time.time()
-                    continue
-
-                if not raw:
-                    continue
-
-                got_any = True
-                rec = parse_device_csv_line(raw) or parse_human_line(raw)
-                if rec:
-                    qrecs.put(rec)
         except Exception:
             pass
 
@@ -264,21 +331,31 @@ def capture_mode(args):
 
     try:
         while True:
-            # Get next usable record (respect --min-conf)
+            # Sleep until a record or key arrives (1s cap keeps the status hint alive)
+            data_event.wait(1.0)
+            data_event.clear()
+
+            # Drain everything queued (the event is binary, the reader enqueues
+            # in bursts); keep the newest record passing --min-conf
+            conf_current = None
             try:
-                rec = qrecs.get(timeout=0.25)
-                last_seen = time.time()
-                # compute a confidence proxy if the device is untrained
-                conf = rec["conf_pct"] if rec["conf_pct"] > 0 else max(0.0, (1.0 - (rec["mad_us"]/(120.0*2))) * 100.0)
-                if conf >= args.min_conf:
-                    rec_current = rec
-                    x = scale_echo(rec["echo_us"], rec["fresh_anchor"], rec["spoil_anchor"])
-                    sys.stdout.write(
-                        f"\rE={rec['echo_us']:7.2f}us  MAD={rec['mad_us']:6.2f}  x={x:.3f}  conf~{conf:5.1f}%  F={rec['fresh_anchor']:.0f}  S={rec['spoil_anchor']:.0f}  [f/s/q]: "
-                    )
-                    sys.stdout.flush()
+                while True:
+                    rec = qrecs.get_nowait()
+                    last_seen = time.time()
+                    # compute a confidence proxy if the device is untrained
+                    conf = rec.conf_pct if rec.conf_pct > 0 else max(0.0, (1.0 - (rec.mad_us/(120.0*2))) * 100.0)
+                    if conf >= args.min_conf:
+                        rec_current = rec
+                        conf_current = conf
             except queue.Empty:
                 pass
+            if conf_current is not None:
+                rec = rec_current
+                x = scale_echo(rec.echo_us, rec.fresh_anchor, rec.spoil_anchor)
+                sys.stdout.write(
+                    f"\rE={rec.echo_us:7.2f}us  MAD={rec.mad_us:6.2f}  x={x:.3f}  conf~{conf_current:5.1f}%  F={rec.fresh_anchor:.0f}  S={rec.spoil_anchor:.0f}  [f/s/q]: "
+                )
+                sys.stdout.flush()
 
             # Consume any key presses
             try:
@@ -290,10 +367,10 @@ def capture_mode(args):
                 if rec_current:
                     lab = 1 if key=="f" else 0
                     rows.append(Sample(
-                        echo_us=rec_current["echo_us"],
+                        echo_us=rec_current.echo_us,
                         label=lab,
-                        fresh_anchor=rec_current["fresh_anchor"],
-                        spoil_anchor=rec_current["spoil_anchor"]
+                        fresh_anchor=rec_current.fresh_anchor,
+                        spoil_anchor=rec_current.spoil_anchor
                     ))
                     saved += 1
                     print(f" +saved ({saved})")
@@ -318,15 +395,21 @@ def capture_mode(args):
         save_csv(args.out, rows)
 
 def train_from_csv(args):
-    rows = load_csv(args.csv)
-    print(f"[train] loaded {len(rows)} rows from {args.csv}")
-    if not rows:
+    cols = load_csv(args.csv)
+    print(f"[train] loaded {len(cols)} rows from {args.csv}")
+    if not len(cols):
         print("No rows to train."); return
-    fa = np.median([r.fresh_anchor for r in rows])
-    sa = np.median([r.spoil_anchor for r in rows])
-    X = np.array([scale_echo(r.echo_us, fa, sa) for r in rows], float).reshape(-1,1)
-    y = np.array([r.label for r in rows], int)
-    if len(set(y.tolist())) < 2:
+    fa = np.median(cols.fresh_anchor)
+    sa = np.median(cols.spoil_anchor)
+    # vectorized scale_echo over the whole session (same math, one pass)
+    if fa == sa: sa = fa + 1.0
+    lo, hi = (fa, sa) if fa < sa else (sa, fa)
+    x = np.clip((cols.echo_us - lo) / (hi - lo), 0.0, 1.0)
+    if fa < sa:  # firmware inverts if smaller echo = fresher
+        x = 1.0 - x
+    X = x.reshape(-1,1)
+    y = cols.label.astype(int)
+    if np.unique(y).size < 2:
         print("Need both classes."); return
     w,b = fit_logistic_1d(X,y)
     z = b + w*X[:,0]; yhat = 1/(1+np.exp(-z))
@@ -337,9 +420,17 @@ def train_from_csv(args):
     print(emit_W_line(w,b))
 
 def live_test(args):
-    rows = load_csv(args.csv) if args.csv else []
-    fa = np.median([r.fresh_anchor for r in rows]) if rows else 1400
-    sa = np.median([r.spoil_anchor for r in rows]) if rows else 2600
+    cols = load_csv(args.csv) if args.csv else None
+    fa = float(np.median(cols.fresh_anchor)) if cols else 1400
+    sa = float(np.median(cols.spoil_anchor)) if cols else 2600
+    # anchors are fixed for the session, so scale_echo collapses to a
+    # 1-D lookup table: one indexed load per line, no divide/clip
+    if fa == sa: sa = fa + 1.0
+    lo, hi = (fa, sa) if fa < sa else (sa, fa)
+    lo_int = int(lo)
+    lut = np.clip(((np.arange(4096) + lo_int) - lo) / (hi - lo), 0.0, 1.0)
+    if fa < sa:
+        lut = 1.0 - lut
     port = args.port or autodetect_port()
     if not port:
         print("No serial port. Use --port COMx."); return
@@ -352,13 +443,15 @@ def live_test(args):
     print("Live test (Ctrl+C to quit)")
     try:
         while True:
-            raw = ser.readline().decode(errors="ignore").strip()
-            rec = parse_device_csv_line(raw) or parse_human_line(raw)
+            raw = ser.readline().strip()
+            if not raw: continue
+            text = raw.decode("ascii", "ignore")
+            rec = parse_device_csv_line(text) or parse_human_line(text)
             if not rec: continue
-            x = scale_echo(rec["echo_us"], fa, sa)
-            fresh = rec["fresh_pct"] if rec["fresh_pct"]>0 else x*100.0
-            conf  = rec["conf_pct"] if rec["conf_pct"]>0 else max(0.0, (1.0 - (rec["mad_us"]/(120.0*2))) * 100.0)
-            print(f"E={rec['echo_us']:7.2f}us  MAD={rec['mad_us']:6.2f}   FreshProb={fresh:6.2f}%   Conf={conf:6.2f}%")
+            x = float(lut[max(0, min(4095, int(rec.echo_us) - lo_int))])
+            fresh = rec.fresh_pct if rec.fresh_pct>0 else x*100.0
+            conf  = rec.conf_pct if rec.conf_pct>0 else max(0.0, (1.0 - (rec.mad_us/(120.0*2))) * 100.0)
+            print(f"E={rec.echo_us:7.2f}us  MAD={rec.mad_us:6.2f}   FreshProb={fresh:6.2f}%   Conf={conf:6.2f}%")
     except KeyboardInterrupt:
         pass
     finally: